@@ -0,0 +1,118 @@
+import hashlib
+import threading
+import numpy as np
+import bittensor as bt
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from bitrecs.llms.chat_gpt import get_openai_client
+
+
+class CandidateRetriever:
+    """
+    Embedding based candidate retrieval.
+    Picks the catalog products closest to the viewed SKU so the LLM only has to rank a short list.
+    Product embeddings are computed once per catalog, in the background, and kept as a float32 matrix.
+    Until a catalog is embedded top_k returns no candidates and callers use their own ranking.
+    """
+
+    EMBEDDING_MODEL = "text-embedding-3-small"
+    EMBEDDING_BATCH = 1000  # API accepts up to 2048 inputs per request
+    QUERY_TIMEOUT = 1.0  # seconds, query embedding sits in front of the LLM call
+    CATALOG_TIMEOUT = 30.0  # seconds per batch, catalog embedding runs off the request path
+    MAX_CATALOGS = 8
+    MAX_QUERIES = 4096
+
+    def __init__(self, key, model=EMBEDDING_MODEL):
+        self.CHATGPT_API_KEY = key
+        if not self.CHATGPT_API_KEY:
+            raise ValueError("CHATGPT_API_KEY is not set")
+        self.model = model
+        # No SDK retries, a slow embedding call must not eat the request budget
+        self.client = get_openai_client(self.CHATGPT_API_KEY).with_options(max_retries=0)
+        # catalog digest -> normalized (n, dim) float32 embeddings
+        self._catalogs: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # query text -> normalized (dim,) float32 embedding
+        self._queries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="catalog-embed")
+
+    def embed(self, texts: list[str], timeout: float = QUERY_TIMEOUT) -> np.ndarray:
+        """Embed texts and return L2 normalized float32 rows."""
+        rows = []
+        for i in range(0, len(texts), self.EMBEDDING_BATCH):
+            response = self.client.embeddings.create(model=self.model,
+                                                     input=texts[i:i + self.EMBEDDING_BATCH],
+                                                     timeout=timeout)
+            rows.extend(d.embedding for d in response.data)
+        matrix = np.asarray(rows, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    @staticmethod
+    def _catalog_digest(names: list[str]) -> str:
+        return hashlib.blake2b("\n".join(names).encode("utf-8", "ignore"), digest_size=16).hexdigest()
+
+    def _embed_catalog(self, digest: str, names: list[str]) -> None:
+        try:
+            matrix = self.embed(names, timeout=self.CATALOG_TIMEOUT)
+            with self._lock:
+                self._catalogs[digest] = matrix
+                while len(self._catalogs) > self.MAX_CATALOGS:
+                    self._catalogs.popitem(last=False)
+            bt.logging.info(f"Embedded catalog {digest[:8]}: {len(names)} products")
+        except Exception as e:
+            bt.logging.warning(f"Catalog embedding failed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(digest)
+
+    def _catalog_embeddings(self, names: list[str]) -> np.ndarray | None:
+        """Embeddings for a known catalog, or None after scheduling a background embed for a new one."""
+        digest = self._catalog_digest(names)
+        with self._lock:
+            matrix = self._catalogs.get(digest)
+            if matrix is not None:
+                self._catalogs.move_to_end(digest)
+                return matrix
+            # Bounded backlog, a catalog that doesn't fit is picked up by a later request
+            if digest in self._pending or len(self._pending) >= self.MAX_CATALOGS:
+                return None
+            self._pending.add(digest)
+        self._executor.submit(self._embed_catalog, digest, names)
+        return None
+
+    def _query_embedding(self, query: str) -> np.ndarray:
+        with self._lock:
+            vector = self._queries.get(query)
+            if vector is not None:
+                self._queries.move_to_end(query)
+                return vector
+        vector = self.embed([query])[0]
+        with self._lock:
+            self._queries[query] = vector
+            while len(self._queries) > self.MAX_QUERIES:
+                self._queries.popitem(last=False)
+        return vector
+
+    def top_k(self, query: str, products: list[dict], k: int = 20) -> list[dict]:
+        """Return the k products most similar to query, best match first. Empty until the catalog is embedded."""
+        if not query or not products:
+            return []
+        names = [str(p.get("name", "")) or str(p.get("sku", "")) for p in products]
+        matrix = self._catalog_embeddings(names)
+        if matrix is None:
+            return []
+        scores = matrix @ self._query_embedding(query)
+
+        k = min(k, len(products))
+        idx = np.argpartition(-scores, k - 1)[:k]
+        idx = idx[np.argsort(-scores[idx])]
+        return [products[i] for i in idx]
+
+
+@lru_cache(maxsize=4)
+def get_candidate_retriever(key: str) -> CandidateRetriever:
+    return CandidateRetriever(key)
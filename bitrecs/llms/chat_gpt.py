@@ -1,39 +1,80 @@
-from openai import OpenAI
+import io
+import json
+import time
+import asyncio
+import httpx
+import bittensor as bt
+from functools import lru_cache
+from openai import OpenAI, AsyncOpenAI, RateLimitError, DefaultHttpxClient, DefaultAsyncHttpxClient
+
+# Keep-alive pool shared by every ChatGPT instance using the same key
+HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+
+@lru_cache(maxsize=4)
+def get_openai_client(key: str) -> OpenAI:
+    return OpenAI(api_key=key, http_client=DefaultHttpxClient(limits=HTTP_LIMITS))
+
+
+def new_async_openai_client(key: str) -> AsyncOpenAI:
+    """
+    Async client for a single event loop, not cached: pooled connections are bound to the loop that opened them.
+    Use with async with so the connections close before the loop does.
+    """
+    # SDK retries disabled, acall_chat_gpt does its own 429 backoff
+    return AsyncOpenAI(api_key=key, max_retries=0, http_client=DefaultAsyncHttpxClient(limits=HTTP_LIMITS))
+
 
 class ChatGPT:
-    def __init__(self, 
+
+    # Max in-flight requests for call_many, keeps fan-out under rate limits
+    MAX_CONCURRENCY = 8
+    MAX_RETRIES = 3
+    # Seconds before the first 429 retry, doubled on each further attempt
+    RETRY_DELAY = 1.0
+    # Seconds for the whole response. The SDK timeout only bounds each connect/read when streaming
+    REQUEST_TIMEOUT = 5.0
+    BATCH_ENDPOINT = "/v1/chat/completions"
+    BATCH_TERMINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(self,
                  key,
-                 model="gpt-3.5-turbo-1106", 
-                 system_prompt="You are a helpful assistant.", 
+                 model="gpt-3.5-turbo-1106",
+                 system_prompt="You are a helpful assistant.",
                  temp=0.0):
-        
+
         self.CHATGPT_API_KEY = key
         if not self.CHATGPT_API_KEY:
             raise ValueError("CHATGPT_API_KEY is not set")
         self.model = model
         self.system_prompt = system_prompt
         self.temp = temp
-        # Create client once during initialization for speed
-        self.client = OpenAI(api_key=self.CHATGPT_API_KEY)
+        # Sync client is shared per key so connections are reused across instances
+        self.client = get_openai_client(self.CHATGPT_API_KEY)
+        # Seconds from request send to first content chunk of the last call
+        self.last_ttft = None
+        # Shared by every call_many on this instance and event loop so overlapping fan-outs stay within the limit
+        self._semaphore = None
+        self._semaphore_loop = None
 
-    def call_chat_gpt(self, prompt) -> str:
+    def _validate_prompt(self, prompt) -> None:
         if not prompt or len(prompt) < 10:
             raise ValueError(f"Prompt too short: {len(prompt) if prompt else 0} characters (minimum 10)")
 
         if not self.CHATGPT_API_KEY:
             raise ValueError("CHATGPT_API_KEY is not set")
 
-        completion = self.client.chat.completions.create(
+    def _completion_args(self, prompt) -> dict:
+        return dict(
             model=self.model,
             messages=[
-            {
-                "role": "user",
-                "content": prompt,
-            }],
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
             temperature=0.0,  # Zero for fastest response
             max_tokens=300,  # Further reduced for faster generation
-            timeout=5.0,  # Reduced timeout for 1-3 second target
-            stream=False,  # Disable streaming for faster completion
+            timeout=self.REQUEST_TIMEOUT,  # Reduced timeout for 1-3 second target
+            stream=True,  # Stream so the first tokens arrive as soon as possible
             top_p=0.1,  # Reduced for more focused responses
             frequency_penalty=0.0,  # No frequency penalty
             presence_penalty=0.0,  # No presence penalty
@@ -41,5 +82,155 @@ class ChatGPT:
             stop=None  # No stop sequences for speed
         )
 
-        thing = completion.choices[0].message.content                
-        return thing
\ No newline at end of file
+    def call_chat_gpt(self, prompt) -> str:
+        self._validate_prompt(prompt)
+
+        t0 = time.perf_counter()
+        self.last_ttft = None
+        completion = self.client.chat.completions.create(**self._completion_args(prompt))
+
+        parts = []
+        for chunk in completion:
+            if time.perf_counter() - t0 > self.REQUEST_TIMEOUT:
+                completion.close()
+                raise TimeoutError(f"ChatGPT response exceeded {self.REQUEST_TIMEOUT}s")
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if content:
+                if self.last_ttft is None:
+                    self.last_ttft = time.perf_counter() - t0
+                parts.append(content)
+
+        if self.last_ttft is not None:
+            bt.logging.debug(f"ChatGPT TTFT: {self.last_ttft:.3f}s")
+        thing = "".join(parts)
+        return thing
+
+    async def acall_chat_gpt(self, prompt, client: AsyncOpenAI | None = None) -> str:
+        """Async streaming call. Opens its own client for the call unless one is passed in (see call_many)."""
+        self._validate_prompt(prompt)
+        if client is None:
+            async with new_async_openai_client(self.CHATGPT_API_KEY) as client:
+                return await self.acall_chat_gpt(prompt, client)
+
+        delay = self.RETRY_DELAY
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                t0 = time.perf_counter()
+                ttft = None
+                completion = await client.chat.completions.create(**self._completion_args(prompt))
+
+                parts = []
+                async for chunk in completion:
+                    if time.perf_counter() - t0 > self.REQUEST_TIMEOUT:
+                        await completion.close()
+                        raise TimeoutError(f"ChatGPT response exceeded {self.REQUEST_TIMEOUT}s")
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        if ttft is None:
+                            ttft = time.perf_counter() - t0
+                        parts.append(content)
+
+                self.last_ttft = ttft
+                return "".join(parts)
+            except RateLimitError:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # A semaphore binds to the loop it first waits on, so each event loop gets its own
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.MAX_CONCURRENCY)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def call_many(self, prompts) -> list[str]:
+        """
+        Run several prompts concurrently on one event loop.
+        Results are returned in the same order as prompts.
+        All prompts share one client, closed when the last one finishes.
+        """
+        semaphore = self._get_semaphore()
+
+        async with new_async_openai_client(self.CHATGPT_API_KEY) as client:
+            async def _bounded(prompt):
+                async with semaphore:
+                    return await self.acall_chat_gpt(prompt, client)
+
+            return await asyncio.gather(*[_bounded(p) for p in prompts])
+
+    def submit_batch(self, prompts: list[str]) -> str:
+        """
+        Submit prompts to the OpenAI Batch API for non-interactive jobs (cache priming, evaluation).
+        Batched requests are billed at a discount with a 24h completion window.
+        Returns the batch id to pass to fetch_batch.
+        """
+        if not prompts:
+            raise ValueError("No prompts to submit")
+
+        lines = []
+        for i, prompt in enumerate(prompts):
+            self._validate_prompt(prompt)
+            body = self._completion_args(prompt)
+            body.pop("stream")
+            body.pop("timeout")
+            lines.append(json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": self.BATCH_ENDPOINT,
+                "body": body
+            }, separators=(',', ':')))
+        payload = "\n".join(lines).encode("utf-8")
+
+        batch_file = self.client.files.create(
+            file=("bitrecs_batch.jsonl", io.BytesIO(payload)),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint=self.BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+        return batch.id
+
+    def fetch_batch(self, batch_id: str, wait: bool = False, poll_interval: float = 30.0) -> tuple[str, list[str | None] | None]:
+        """
+        Fetch results of a batch submitted with submit_batch.
+        Returns (status, results). results is None while the batch is still running.
+        Once the batch reaches a terminal state (completed, failed, expired, cancelled), results holds the
+        completions in prompt order, with None for items that produced no output. Expired and cancelled
+        batches keep whatever output they produced.
+        When wait is True, polls every poll_interval seconds until the batch reaches a terminal state.
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        while wait and batch.status not in self.BATCH_TERMINAL_STATES:
+            time.sleep(poll_interval)
+            batch = self.client.batches.retrieve(batch_id)
+
+        if batch.status not in self.BATCH_TERMINAL_STATES:
+            return batch.status, None
+
+        total = batch.request_counts.total if batch.request_counts else 0
+        results = [None] * total
+        if not batch.output_file_id:
+            return batch.status, results
+
+        content = self.client.files.content(batch.output_file_id).text
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            response = item.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            idx = int(item["custom_id"])
+            if idx >= len(results):
+                results.extend([None] * (idx + 1 - len(results)))
+            results[idx] = response["body"]["choices"][0]["message"]["content"]
+        return batch.status, results
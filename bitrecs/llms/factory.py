@@ -23,6 +23,9 @@ class LLM(Enum):
 
 class LLMFactory:
 
+    # Servers whose clients send system_prompt as a separate system message
+    SYSTEM_PROMPT_SERVERS = (LLM.OLLAMA_LOCAL, LLM.CHAT_GPT, LLM.GEMINI)
+
     @staticmethod
     def query_llm(server: LLM, model: str, 
                   system_prompt="You are a helpful assistant", 
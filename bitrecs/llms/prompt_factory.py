@@ -1,15 +1,38 @@
 import re
 import json
+import math
 import time
+import hashlib
+import orjson
 import tiktoken
 import bittensor as bt
 import bitrecs.utils.constants as CONST
-from functools import lru_cache
-from typing import List, Optional, Dict
-from datetime import datetime
+from collections import Counter, OrderedDict
+from functools import lru_cache, cached_property
+from typing import List, Optional, Dict, Tuple
+from dataclasses import dataclass
 from bitrecs.commerce.user_profile import UserProfile
 from bitrecs.commerce.product import ProductFactory
 from bitrecs.utils.misc import ttl_cache
+from bitrecs.llms.candidates import CandidateRetriever
+
+
+@dataclass(frozen=True, slots=True)
+class PersonaTable:
+    """Persona fields as parallel tuples, positions given by index."""
+    names: tuple[str, ...]
+    priorities: tuple[str, ...]
+    system_prompts: tuple[str, ...]
+    index: Dict[str, int]
+
+
+@dataclass(frozen=True, slots=True)
+class CatalogIndex:
+    """Parsed catalog products with an inverted index of L2 normalized TF-IDF name weights, built once per context."""
+    records: tuple[dict, ...]
+    postings: Dict[str, tuple[tuple[int, float], ...]]
+    idf: Dict[str, float]
+
 
 class PromptFactory:
 
@@ -17,10 +40,44 @@ class PromptFactory:
 
     ENGINE_MODE = "complimentary"  #similar, sequential
     
-    # Response cache for similar queries (5 minute TTL)
-    _response_cache: Dict[str, List] = {}
-    _cache_timestamps: Dict[str, float] = {}
+    # Response cache for similar queries (5 minute TTL, LRU bounded)
+    _response_cache: "OrderedDict[str, tuple[float, List]]" = OrderedDict()
     CACHE_TTL = 300  # 5 minutes
+    CACHE_MAX_ENTRIES = 4096
+
+    # Parsed LLM outputs keyed by blake2b digest of the raw response
+    _parse_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+    PARSE_CACHE_SIZE = 1024
+
+    # Built user prompts keyed by (sku, num_recs, season, cart skus, context digest, retriever used)
+    _prompt_cache: "OrderedDict[tuple, str]" = OrderedDict()
+    PROMPT_CACHE_SIZE = 512
+
+    # Parsed catalogs keyed by context digest, None for contexts that are not a product array
+    _catalog_cache: "OrderedDict[bytes, Optional[CatalogIndex]]" = OrderedDict()
+    CATALOG_CACHE_SIZE = 8
+
+    # Token budget for the products block of the prompt
+    CONTEXT_TOKEN_BUDGET = 400
+    # Products always packed beyond num_recs, even past the budget, so the LLM has choices to rank
+    CONTEXT_EXTRA_PRODUCTS = 5
+    # Max products shortlisted by embedding retrieval before packing
+    MAX_CANDIDATES = 20
+    _TERM_RE = re.compile(r"[a-z0-9]+")
+
+    # Structural tokens for the balanced brace scan: escapes, quotes and braces
+    _OBJ_TOKEN_RE = re.compile(r'\\.|["{}]', re.DOTALL)
+
+    # Field patterns for the last resort line scan in tryparse_llm
+    _SKU_RE = re.compile(r'"sku":\s*"([^"]+)"')
+    _NAME_RE = re.compile(r'"name":\s*"([^"]+)"')
+    _PRICE_RE = re.compile(r'"price":\s*"([^"]+)"')
+    _REASON_RE = re.compile(r'"reason":\s*"([^"]+)"')
+
+    DEFAULT_PERSONA = "ecommerce_retail_store_manager"
+
+    # Per-persona fields and system prompts as parallel tuples, built once at import (see bottom of module)
+    PERSONA_TABLE: "PersonaTable" = None
     
     PERSONAS = {
         "luxury_concierge": {
@@ -54,14 +111,16 @@ class PromptFactory:
                  context: str, 
                  num_recs: int = 5,                                  
                  profile: Optional[UserProfile] = None,
-                 debug: bool = False) -> None:
+                 debug: bool = False,
+                 retriever: Optional[CandidateRetriever] = None) -> None:
         """
         Generates a prompt for product recommendations based on the provided SKU and context.
         :param sku: The SKU of the product being viewed.
         :param context: The context string containing available products.
         :param num_recs: The number of recommendations to generate (default is 5).
         :param profile: Optional UserProfile object containing user-specific data.
-        :param debug: If True, enables debug logging."""
+        :param debug: If True, enables debug logging.
+        :param retriever: Optional CandidateRetriever used to shortlist products by embedding similarity."""
 
         if len(sku) < CONST.MIN_QUERY_LENGTH or len(sku) > CONST.MAX_QUERY_LENGTH:
             raise ValueError(f"SKU must be between {CONST.MIN_QUERY_LENGTH} and {CONST.MAX_QUERY_LENGTH} characters long")
@@ -72,141 +131,259 @@ class PromptFactory:
         self.context = context
         self.num_recs = num_recs
         self.debug = debug
+        self.retriever = retriever
+        self._ranking = None  # how _compress_context ranked the catalog: "embedding", "tfidf" or "raw"
         self.catalog = []
         self.cart = []
-        self.cart_json = "[]"
         self.orders = []
         self.order_json = "[]"
         self.season =  PromptFactory.SEASON       
         self.engine_mode = PromptFactory.ENGINE_MODE 
+        table = PromptFactory.PERSONA_TABLE
         if not profile:
-            self.persona = "ecommerce_retail_store_manager"
+            self.persona = PromptFactory.DEFAULT_PERSONA
         else:
             self.profile = profile
-            self.persona = profile.site_config.get("profile", "ecommerce_retail_store_manager")
-            if not self.persona or self.persona not in PromptFactory.PERSONAS:
-                bt.logging.error(f"Invalid persona: {self.persona}. Must be one of {list(PromptFactory.PERSONAS.keys())}")
-                self.persona = "ecommerce_retail_store_manager"
+            self.persona = profile.site_config.get("profile", PromptFactory.DEFAULT_PERSONA)
+            if self.persona not in table.index:
+                bt.logging.error(f"Invalid persona: {self.persona}. Must be one of {list(table.names)}")
+                self.persona = PromptFactory.DEFAULT_PERSONA
             self.cart = self._sort_cart_keys(profile.cart)
-            self.cart_json = json.dumps(self.cart, separators=(',', ':'))
             self.orders = profile.orders
             # self.order_json = json.dumps(self.orders, separators=(',', ':'))
-        
-        self.sku_info = ProductFactory.find_sku_name(self.sku, self.context)    
+        self._persona_idx = table.index[self.persona]
+
+    @cached_property
+    def sku_info(self) -> str:
+        """Name of the viewed SKU, looked up in the context only when first needed."""
+        return ProductFactory.find_sku_name(self.sku, self.context)
+
+    @cached_property
+    def _context_digest(self) -> bytes:
+        return hashlib.blake2b(str(self.context).encode("utf-8", "ignore"), digest_size=16).digest()
 
     @classmethod
     def _get_cache_key(cls, sku: str, context: str, num_recs: int, persona: str) -> str:
         """Generate cache key for similar queries"""
         # Create a simplified cache key based on SKU category and context similarity
-        context_hash = hash(context[:200])  # Use first 200 chars for similarity
+        # blake2b is stable across processes, unlike the PYTHONHASHSEED randomized hash()
+        context_hash = hashlib.blake2b(context.encode("utf-8", "ignore")[:2048], digest_size=12).hexdigest()
         return f"{sku}_{context_hash}_{num_recs}_{persona}"
     
     @classmethod
     def _get_cached_response(cls, cache_key: str) -> Optional[List]:
         """Get cached response if still valid"""
-        if cache_key in cls._response_cache:
-            timestamp = cls._cache_timestamps.get(cache_key, 0)
-            if time.time() - timestamp < cls.CACHE_TTL:
+        entry = cls._response_cache.get(cache_key)
+        if entry is not None:
+            timestamp, response = entry
+            if time.monotonic() - timestamp < cls.CACHE_TTL:
+                cls._response_cache.move_to_end(cache_key)
                 bt.logging.info(f"🎯 CACHE HIT: Using cached response for {cache_key[:20]}...")
-                return cls._response_cache[cache_key]
+                return response
             else:
                 # Remove expired cache entry
                 cls._response_cache.pop(cache_key, None)
-                cls._cache_timestamps.pop(cache_key, None)
         return None
     
     @classmethod
     def _cache_response(cls, cache_key: str, response: List) -> None:
         """Cache response with timestamp"""
-        cls._response_cache[cache_key] = response
-        cls._cache_timestamps[cache_key] = time.time()
+        cls._response_cache[cache_key] = (time.monotonic(), response)
+        cls._response_cache.move_to_end(cache_key)
+        while len(cls._response_cache) > cls.CACHE_MAX_ENTRIES:
+            cls._response_cache.popitem(last=False)
         bt.logging.info(f"💾 CACHE STORE: Cached response for {cache_key[:20]}...")
     
 
-    def _sort_cart_keys(self, cart: List[dict]) -> List[str]:
-        ordered_cart = []
-        for item in cart:
-            ordered_item = {
-                'sku': item.get('sku', ''),
-                'name': item.get('name', ''),
-                'price': item.get('price', '')
-            }
-            ordered_cart.append(ordered_item)
-        return ordered_cart
+    _CART_FIELDS = ('sku', 'name', 'price')
+
+    def _sort_cart_keys(self, cart: List[dict]) -> List[dict]:
+        return [{k: item.get(k, '') for k in PromptFactory._CART_FIELDS} for item in cart]
     
     
-    def generate_prompt(self) -> str:
-        """Generates a text prompt for product recommendations with persona details."""
-        bt.logging.info("PROMPT generating prompt: {}".format(self.sku))
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        return PromptFactory._TERM_RE.findall(str(text).lower())
+
+    def _compress_context(self) -> str:
+        """
+        Extractive context compression.
+        Ranks catalog products by relevance to the viewed SKU and greedily packs
+        the best matches until CONTEXT_TOKEN_BUDGET is reached, but never fewer than
+        num_recs + CONTEXT_EXTRA_PRODUCTS products (when the catalog has that many).
+        With a retriever, ranking uses embedding similarity over at most MAX_CANDIDATES products,
+        otherwise TF-IDF cosine similarity of product names.
+        Falls back to a plain character cut if the context is not a product array.
+        """
+        index = self._catalog_index()
+        if index is None:
+            context_str = str(self.context)
+            if len(context_str) > 600:
+                context_str = context_str[:600] + "..."
+            self._ranking = "raw"
+            return context_str
+
+        viewed_sku = self.sku.lower()
+        ranked = None
+        if self.retriever is not None and self.sku_info:
+            try:
+                k = max(PromptFactory.MAX_CANDIDATES, self.num_recs + PromptFactory.CONTEXT_EXTRA_PRODUCTS)
+                # Full catalog so its embeddings are shared by every SKU, one extra for the viewed SKU skipped below
+                ranked = self.retriever.top_k(self.sku_info, list(index.records), k + 1)
+            except Exception as e:
+                bt.logging.warning(f"Candidate retrieval failed, using TF-IDF ranking: {e}")
+        if ranked:
+            self._ranking = "embedding"
+        else:
+            ranked = self._rank_by_tfidf(index)
+            self._ranking = "tfidf"
+
+        min_entries = self.num_recs + PromptFactory.CONTEXT_EXTRA_PRODUCTS
+        entries = []
+        used = 0
+        for p in ranked:
+            if str(p["sku"]).lower() == viewed_sku:
+                continue
+            entry = orjson.dumps({"sku": p.get("sku"), "name": p.get("name", ""), "price": p.get("price", "")}).decode()
+            cost = PromptFactory._estimate_tokens(entry)
+            if used + cost > PromptFactory.CONTEXT_TOKEN_BUDGET and len(entries) >= min_entries:
+                break
+            entries.append(entry)
+            used += cost
+
+        return "[" + ",".join(entries) + "]"
+
+    def _catalog_index(self) -> Optional[CatalogIndex]:
+        """Parsed catalog and its TF-IDF weights, shared by every request on the same context."""
+        cache = PromptFactory._catalog_cache
+        digest = self._context_digest
+        if digest in cache:
+            cache.move_to_end(digest)
+            return cache[digest]
 
-        today = datetime.now().strftime("%Y-%m-%d")
+        products = ProductFactory.try_parse_context(self.context)
+        index = None
+        if products and isinstance(products, list):
+            index = PromptFactory._build_catalog_index(products)
+        cache[digest] = index
+        while len(cache) > PromptFactory.CATALOG_CACHE_SIZE:
+            cache.popitem(last=False)
+        return index
+
+    @staticmethod
+    def _build_catalog_index(products: list) -> CatalogIndex:
+        records = tuple(p for p in products if isinstance(p, dict) and p.get("sku"))
+        product_terms = [Counter(PromptFactory._terms(p.get("name", ""))) for p in records]
+        doc_freq = Counter()
+        for terms in product_terms:
+            doc_freq.update(terms.keys())
+        n_docs = len(records)
+        idf = {t: math.log((n_docs + 1) / (df + 1)) + 1 for t, df in doc_freq.items()}
+
+        postings = {}
+        for i, terms in enumerate(product_terms):
+            weights = {t: tf * idf[t] for t, tf in terms.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values()))
+            for t, w in weights.items():
+                postings.setdefault(t, []).append((i, w / norm))
+        return CatalogIndex(records=records,
+                            postings={t: tuple(p) for t, p in postings.items()},
+                            idf=idf)
+
+    def _rank_by_tfidf(self, index: CatalogIndex) -> List[dict]:
+        """
+        Catalog products by TF-IDF cosine similarity to the viewed SKU name.
+        Only products sharing a term with the query are scored, the rest follow in catalog order.
+        """
+        scores: Dict[int, float] = {}
+        # Terms missing from the catalog have no postings and can't change any score
+        for t, tf in Counter(self._terms(self.sku_info)).items():
+            qw = tf * index.idf.get(t, 0.0)
+            for i, w in index.postings.get(t, ()):
+                scores[i] = scores.get(i, 0.0) + qw * w
+        if not scores:
+            return list(index.records)
+
+        # Query norm is the same for every product, so it doesn't change the order. Ties keep catalog order
+        matched = sorted(scores, key=lambda i: (-scores[i], i))
+        return [index.records[i] for i in matched] + [p for i, p in enumerate(index.records) if i not in scores]
+
+    def generate_system_prompt(self) -> str:
+        """Returns the static system prompt for this persona, identical across requests so it can be prefix cached."""
+        # Persona index is resolved once in __init__
+        return PromptFactory.PERSONA_TABLE.system_prompts[self._persona_idx]
+
+    def generate_user_prompt(self) -> str:
+        """
+        Returns the per-request part of the prompt: sku, season, cart and available products.
+        Identical requests against the same catalog reuse the cached prompt and skip context compression.
+        With a retriever, prompts built from the TF-IDF fallback are not cached so the embedding
+        ranking is picked up once the catalog is embedded or retrieval recovers.
+        """
+        cart_skus = tuple(item.get('sku', '') for item in self.cart[:2])  # First 2 items only
+        key = (self.sku, self.num_recs, self.season, cart_skus, self._context_digest, self.retriever is not None)
+
+        cache = PromptFactory._prompt_cache
+        prompt = cache.get(key)
+        if prompt is not None:
+            cache.move_to_end(key)
+            return prompt
+
+        prompt = self._build_user_prompt(cart_skus)
+        if self.retriever is not None and self._ranking == "tfidf":
+            return prompt
+        cache[key] = prompt
+        if len(cache) > PromptFactory.PROMPT_CACHE_SIZE:
+            cache.popitem(last=False)
+        return prompt
+
+    def _build_user_prompt(self, cart_skus: tuple) -> str:
         season = self.season
-        persona_data = self.PERSONAS[self.persona]
-        
-        # Validate persona data structure
-        if not persona_data or 'priorities' not in persona_data or 'description' not in persona_data:
-            bt.logging.error(f"Invalid persona data for {self.persona}: {persona_data}")
-            # Fallback to default persona
-            persona_data = self.PERSONAS["ecommerce_retail_store_manager"]
 
         # Ultra-minimal prompt for 1-3 second response time
-        # Aggressive context truncation (500 chars = ~125 tokens max)
-        context_str = str(self.context)
-        if len(context_str) > 600:  # Reduced from 800 for faster processing
-            context_str = context_str[:600] + "..."
-        
-        # Simplified persona - only essential info
-        try:
-            persona_priorities = ', '.join(persona_data['priorities'][:2])  # Top 2 priorities only
-        except (KeyError, IndexError, TypeError) as e:
-            bt.logging.error(f"Error extracting persona priorities: {e}")
-            persona_priorities = "quality, value, customer satisfaction"  # Fallback priorities
-        
+        # Only the products most relevant to the viewed SKU, up to CONTEXT_TOKEN_BUDGET
+        context_str = self._compress_context()
+
         # Minimal cart context (only if essential)
         cart_context = ""
-        if hasattr(self, 'cart') and self.cart and len(self.cart) > 0:
-            cart_items = [item.get('sku', '') for item in self.cart[:2]]  # First 2 items only
-            if cart_items:
-                cart_context = f"\nCart: {', '.join(cart_items)}"
-        
-        # Ultra-compact prompt for maximum speed (1-3 seconds)
-        prompt = f"""
-            Recommend {self.num_recs} products for {self.sku} ({season}).  
-            Style: {persona_data['description']}  
-            Values: {persona_priorities}{cart_context}  
-            Products: {context_str}  
+        if cart_skus:
+            cart_context = "\nCart: " + ", ".join(cart_skus)
 
-            Critical Rules:  
-            - Return only a JSON array, no extra text.  
-            - Exactly {self.num_recs} items, no {self.sku}, no duplicates, from context only.  
-            - Exclude products already in cart.  
-            - Match gender of SKU (neutral → neutral), never mix genders.  
-            - Keep pet and baby products separate.  
-            - Stay within the same product category as the input SKU.
-            - Rank by relevance/profitability.  
+        return "".join([
+            "\n            Recommend exactly ", str(self.num_recs), " products for ", self.sku,
+            " (", season, "), never ", self.sku, " itself.", cart_context,
+            "  \n            Products: ", context_str, "  \n        "
+        ])
 
-            Reason Guidelines:  
-            - Each item must have: "sku", "name", "price", "reason".  
-            - Reason = one short plain sentence, no punctuation/line breaks.  
-            - Vary reasoning styles (Perfect/Ideal/Great choice/etc.).  
-            - Explain specific use case or complementarity. 
+    def generate_prompt(self) -> str:
+        """Generates a text prompt for product recommendations with persona details."""
+        # Static persona/rules block first so the prefix is shared across requests
+        return "".join(self.generate_prompt_parts())
 
-            Format:  
-            [{{"sku": "ABC", "name": "Product Name - Category | Subcategory", "price": "99", "reason": "Why it fits"}}]
+    def generate_prompt_parts(self) -> Tuple[str, str]:
         """
+        Returns (system_prompt, user_prompt) for servers that take a separate system message.
+        Joined they are exactly generate_prompt(), logging is the same for both.
+        """
+        bt.logging.info("PROMPT generating prompt: {}".format(self.sku))
+
+        system_prompt = self.generate_system_prompt()
+        user_prompt = self.generate_user_prompt()
+        prompt = "".join([system_prompt, user_prompt])
 
         prompt_length = len(prompt)
         bt.logging.info(f"LLM QUERY Prompt length: {prompt_length}")
         
-        # Always calculate and log token count for monitoring
-        token_count = PromptFactory.get_token_count(prompt)
-        bt.logging.info(f"LLM QUERY Prompt Token count: {token_count}")
+        # Cheap estimate for monitoring, exact tiktoken count only when debugging
+        bt.logging.info(f"LLM QUERY Prompt Token estimate: {PromptFactory._estimate_tokens(prompt)}")
         
         if self.debug:
-            bt.logging.debug(f"Persona: {self.persona}, Season: {season}, Values: {persona_priorities}")
+            bt.logging.debug(f"LLM QUERY Prompt Token count: {PromptFactory.get_token_count(prompt)}")
+            persona_priorities = PromptFactory.PERSONA_TABLE.priorities[self._persona_idx]
+            bt.logging.debug(f"Persona: {self.persona}, Season: {self.season}, Values: {persona_priorities}")
             bt.logging.debug(f"Prompt: {prompt}")
 
-        return prompt
+        return system_prompt, user_prompt
     
     @classmethod
     def get_cached_response(cls, sku: str, context: str, num_recs: int, persona: str) -> Optional[List]:
@@ -235,6 +412,20 @@ class PromptFactory:
         return len(tokens)
     
     
+    @staticmethod
+    def get_token_counts(prompts: List[str], encoding_name: str="o200k_base") -> List[int]:
+        """Token counts for many prompts, encoded in parallel threads by tiktoken."""
+        if not prompts:
+            return []
+        encoding = PromptFactory._get_cached_encoding(encoding_name)
+        tokens = encoding.encode_batch(prompts, num_threads=min(8, len(prompts)))
+        return [len(t) for t in tokens]
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        """Fast token estimate without encoding: chars/4 scaled by 1.25 for JSON heavy text."""
+        return (len(text) * 5) >> 4
+
     @staticmethod
     @lru_cache(maxsize=4)
     def _get_cached_encoding(encoding_name: str):
@@ -250,22 +441,75 @@ class PromptFactory:
     def tryparse_llm(input_str: str) -> list:
         """
         Robust JSON parsing with comprehensive error handling and logging
+        Results are cached by a digest of the raw response so repeat payloads skip the parse ladder
         """
         if not input_str or len(input_str) < 10:
             bt.logging.error("Empty or too short LLM response")
             return []
-        
+
+        key = hashlib.blake2b(input_str.encode("utf-8", "ignore"), digest_size=16).digest()
+        cache = PromptFactory._parse_cache
+        cached = cache.get(key)
+        if cached is None:
+            cached = tuple(PromptFactory._tryparse_llm(input_str))
+            cache[key] = cached
+            if len(cache) > PromptFactory.PARSE_CACHE_SIZE:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+            bt.logging.trace(f"Parse cache hit: {len(cached)} items")
+
+        # Copies so callers can pad or trim results without touching the cache
+        return [dict(item) if isinstance(item, dict) else item for item in cached]
+
+    @staticmethod
+    def _iter_json_objects(text: str):
+        """
+        Yield each top level {...} substring in a single pass.
+        Tracks brace depth and skips braces inside JSON strings, so nested objects stay intact.
+        String state is only tracked inside an object, stray quotes in the surrounding prose are ignored.
+        """
+        depth = 0
+        start = -1
+        in_string = False
+        for m in PromptFactory._OBJ_TOKEN_RE.finditer(text):
+            token = m.group()
+            if depth == 0:
+                if token == '{':
+                    start = m.start()
+                    depth = 1
+                continue
+            if token == '"':
+                in_string = not in_string
+            elif in_string or len(token) > 1:
+                continue
+            elif token == '{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    yield text[start:m.end()]
+
+    @staticmethod
+    def _json_loads(text: str):
+        """orjson first, stdlib json only for input orjson rejects (e.g. NaN). Raises json.JSONDecodeError."""
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            return json.loads(text)
+
+    @staticmethod
+    def _tryparse_llm(input_str: str) -> list:
         # Log the raw response for debugging
         bt.logging.info(f"Raw LLM response length: {len(input_str)}")
         bt.logging.debug(f"Raw LLM response: {input_str[:500]}...")
         
         # Enhanced cleanup - remove common LLM artifacts
         cleaned_input = input_str.replace("```json", "").replace("```", "").strip()
-        cleaned_input = cleaned_input.replace("```", "").strip()
         
         # Method 1: Direct JSON parsing (fastest)
         try:
-            result = json.loads(cleaned_input)
+            result = PromptFactory._json_loads(cleaned_input)
             if isinstance(result, list) and len(result) > 0:
                 bt.logging.info(f"Direct JSON parsing successful: {len(result)} items")
                 return result
@@ -279,7 +523,7 @@ class PromptFactory:
             if end > start:
                 try:
                     json_str = cleaned_input[start:end+1]
-                    result = json.loads(json_str)
+                    result = PromptFactory._json_loads(json_str)
                     if isinstance(result, list) and len(result) > 0:
                         bt.logging.info(f"Pattern JSON parsing successful: {len(result)} items")
                         return result
@@ -288,26 +532,23 @@ class PromptFactory:
         
         # Method 3: Try to find multiple JSON objects and combine
         try:
-            # Look for individual JSON objects
+            # Look for individual JSON objects, one balanced {...} at a time
             objects = []
-            current_pos = 0
-            while current_pos < len(cleaned_input):
-                start = cleaned_input.find('{', current_pos)
-                if start == -1:
-                    break
-                end = cleaned_input.find('}', start)
-                if end == -1:
-                    break
-                
+            candidates = list(PromptFactory._iter_json_objects(cleaned_input))
+            candidates.reverse()
+            while candidates:
+                obj_str = candidates.pop()
                 try:
-                    obj_str = cleaned_input[start:end+1]
-                    obj = json.loads(obj_str)
+                    obj = PromptFactory._json_loads(obj_str)
                     if isinstance(obj, dict) and 'sku' in obj:
                         objects.append(obj)
+                        continue
                 except json.JSONDecodeError:
                     pass
-                
-                current_pos = end + 1
+                # Not a product itself, look at the objects nested inside it
+                nested = list(PromptFactory._iter_json_objects(obj_str[1:-1]))
+                nested.reverse()
+                candidates.extend(nested)
             
             if len(objects) > 0:
                 bt.logging.info(f"Individual object parsing successful: {len(objects)} items")
@@ -317,11 +558,15 @@ class PromptFactory:
         
         # Method 4: JSON repair (last resort)
         try:
-            repaired = json_repair.repair_json(cleaned_input)
-            result = json.loads(repaired)
+            # Imported here, only responses that reach this branch pay for it
+            from json_repair import repair_json
+            repaired = repair_json(cleaned_input)
+            result = PromptFactory._json_loads(repaired)
             if isinstance(result, list) and len(result) > 0:
                 bt.logging.info(f"JSON repair successful: {len(result)} items")
                 return result
+        except ImportError as e:
+            bt.logging.warning(f"json_repair not available, skipping repair: {e}")
         except Exception as e:
             bt.logging.debug(f"JSON repair failed: {e}")
         
@@ -332,14 +577,15 @@ class PromptFactory:
             fallback_objects = []
             
             for line in lines:
-                if 'sku' in line.lower() and ('name' in line.lower() or 'price' in line.lower()):
+                lowered = line.lower()
+                if 'sku' in lowered and ('name' in lowered or 'price' in lowered):
                     # Try to extract basic info
                     try:
                         # Simple extraction for emergency cases
-                        sku_match = re.search(r'"sku":\s*"([^"]+)"', line)
-                        name_match = re.search(r'"name":\s*"([^"]+)"', line)
-                        price_match = re.search(r'"price":\s*"([^"]+)"', line)
-                        reason_match = re.search(r'"reason":\s*"([^"]+)"', line)
+                        sku_match = PromptFactory._SKU_RE.search(line)
+                        name_match = PromptFactory._NAME_RE.search(line)
+                        price_match = PromptFactory._PRICE_RE.search(line)
+                        reason_match = PromptFactory._REASON_RE.search(line)
                         
                         if sku_match and name_match:
                             obj = {
@@ -360,4 +606,45 @@ class PromptFactory:
         
         bt.logging.error(f"No valid JSON found in LLM response: {cleaned_input[:200]}...")
         return []
-    
\ No newline at end of file
+
+
+def _build_system_prompt(description: str, priorities: str) -> str:
+    return f"""
+            You are a product recommendation assistant. You MUST respond with valid JSON array only. No explanations, no text outside JSON.
+            Style: {description}  
+            Values: {priorities}  
+
+            Critical Rules:  
+            - Return only a JSON array, no extra text.  
+            - Exactly the requested number of items, never the viewed SKU, no duplicates, from context only.  
+            - Exclude products already in cart.  
+            - Match gender of SKU (neutral → neutral), never mix genders.  
+            - Keep pet and baby products separate.  
+            - Stay within the same product category as the input SKU.
+            - Rank by relevance/profitability.  
+
+            Reason Guidelines:  
+            - Each item must have: "sku", "name", "price", "reason".  
+            - Reason = one short plain sentence, no punctuation/line breaks.  
+            - Vary reasoning styles (Perfect/Ideal/Great choice/etc.).  
+            - Explain specific use case or complementarity. 
+
+            Format:  
+            [{{"sku": "ABC", "name": "Product Name - Category | Subcategory", "price": "99", "reason": "Why it fits"}}]
+        """
+
+
+def _build_persona_table(personas: dict) -> PersonaTable:
+    names = tuple(personas)
+    descriptions = tuple(personas[n]['description'] for n in names)
+    # Simplified persona - only essential info, top 2 priorities
+    priorities = tuple(', '.join(personas[n]['priorities'][:2]) for n in names)
+    system_prompts = tuple(_build_system_prompt(d, p) for d, p in zip(descriptions, priorities))
+    return PersonaTable(names=names,
+                        priorities=priorities,
+                        system_prompts=system_prompts,
+                        index={n: i for i, n in enumerate(names)})
+
+
+# Precomputed once at import, one static system prompt per persona
+PromptFactory.PERSONA_TABLE = _build_persona_table(PromptFactory.PERSONAS)
@@ -171,6 +171,13 @@ def add_miner_args(cls, parser):
         help="Which LLM model to use",
     )
 
+    parser.add_argument(
+        "--llm.embed_candidates",
+        action="store_true",
+        help="CHAT_GPT only: shortlist catalog products by OpenAI embedding similarity before the LLM call.",
+        default=False,
+    )
+
 
 
 def add_validator_args(cls, parser):
@@ -18,6 +18,7 @@
 
 
 
+import os
 import sys
 import time
 import typing
@@ -36,6 +37,7 @@ from bitrecs.commerce.user_profile import UserProfile
 from bitrecs.protocol import BitrecsRequest
 from bitrecs.llms.prompt_factory import PromptFactory
 from bitrecs.llms.factory import LLM, LLMFactory
+from bitrecs.llms.candidates import get_candidate_retriever
 from bitrecs.utils.runtime import execute_periodically
 from bitrecs.utils.uids import best_uid
 from bitrecs.utils.version import LocalMetadata
@@ -48,7 +50,8 @@ async def do_work(user_prompt: str,
                   model: str,
                   system_prompt="You are a helpful assistant.", 
                   profile : UserProfile = None,
-                  debug_prompts=False) -> List[str]:
+                  debug_prompts=False,
+                  embed_candidates=False) -> List[str]:
     """
     Miner work is done here.
     This function is invoked by the validator Forward function to generate product recommendations based on the user prompt and context.    
@@ -68,6 +71,7 @@ async def do_work(user_prompt: str,
         system_prompt (str): The system prompt for the LLM.
         profile (UserProfile): The user profile to use when generating recommendations.
         debug_prompts (bool): Whether to log debug information about the prompts.
+        embed_candidates (bool): Whether to shortlist products by embedding similarity (CHAT_GPT only).
 
     Returns:
         typing.List[str]: A list of product recommendations generated by the miner.
@@ -91,18 +95,28 @@ async def do_work(user_prompt: str,
         bt.logging.info(f"⚡ SPEED BOOST: Using cached/precomputed response - {len(cached_response)} items")
         return cached_response
 
+    # Two phase: shortlist products by embedding similarity, then let the LLM rank the shortlist
+    retriever = None
+    if embed_candidates and server == LLM.CHAT_GPT and os.environ.get("CHATGPT_API_KEY"):
+        retriever = get_candidate_retriever(os.environ.get("CHATGPT_API_KEY"))
+
     factory = PromptFactory(sku=user_prompt,
                             context=context, 
                             num_recs=num_recs,                                                         
                             debug=debug_prompts,
-                            profile=profile)
-    prompt = factory.generate_prompt()
+                            profile=profile,
+                            retriever=retriever)
+    if server in LLMFactory.SYSTEM_PROMPT_SERVERS:
+        # Static persona/rules go in the system message so the prefix is cached across requests
+        llm_system_prompt, prompt = factory.generate_prompt_parts()
+    else:
+        # Persona/rules, including the JSON-only instruction, are already the first part of the prompt
+        llm_system_prompt = system_prompt
+        prompt = factory.generate_prompt()
     try:
-        # JSON-focused system prompt for reliable parsing
-        optimized_system_prompt = "You are a product recommendation assistant. You MUST respond with valid JSON array only. No explanations, no text outside JSON."
         llm_response = LLMFactory.query_llm(server=server, 
                                             model=model, 
-                                            system_prompt=optimized_system_prompt, 
+                                            system_prompt=llm_system_prompt, 
                                             temp=0.0, user_prompt=prompt)  # Set to 0.03 as requested
         if not llm_response or len(llm_response) < 10:
             bt.logging.error("LLM response is empty.")
@@ -234,7 +248,8 @@ class Miner(BaseMinerNeuron):
                                     server=server, 
                                     model=model, 
                                     profile=user_profile,
-                                    debug_prompts=debug_prompts)            
+                                    debug_prompts=debug_prompts,
+                                    embed_candidates=self.config.llm.embed_candidates)            
             bt.logging.info(f"LLM {self.model} - Results: count ({len(results)})")
         except Exception as e:
             bt.logging.error(f"\033[31mFATAL ERROR calling do_work: {e!r} \033[0m")
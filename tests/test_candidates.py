@@ -0,0 +1,98 @@
+import json
+from types import SimpleNamespace
+from collections import OrderedDict
+from bitrecs.llms.candidates import CandidateRetriever
+from bitrecs.llms.prompt_factory import PromptFactory
+
+
+VECTORS = {
+    "red shoe": [1.0, 0.0, 0.0],
+    "red boot": [0.9, 0.1, 0.0],
+    "blue shoe": [0.6, 0.8, 0.0],
+    "coffee mug": [0.0, 0.0, 1.0],
+    "query": [1.0, 0.0, 0.0],
+}
+
+
+class StubEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def create(self, model, input, timeout):
+        self.calls.append(list(input))
+        return SimpleNamespace(data=[SimpleNamespace(embedding=VECTORS[text]) for text in input])
+
+
+def make_retriever() -> tuple[CandidateRetriever, StubEmbeddings]:
+    retriever = CandidateRetriever("test-key")
+    stub = StubEmbeddings()
+    retriever.client = SimpleNamespace(embeddings=stub)
+    return retriever, stub
+
+
+products = [
+    {"sku": "MUG", "name": "coffee mug"},
+    {"sku": "BLUE", "name": "blue shoe"},
+    {"sku": "RED", "name": "red shoe"},
+    {"sku": "BOOT", "name": "red boot"},
+]
+
+
+def wait_for_background(retriever: CandidateRetriever) -> None:
+    # Single worker executor, so a no-op submitted now completes after the embed job
+    retriever._executor.submit(lambda: None).result()
+
+
+def test_top_k_skips_until_catalog_embedded():
+    retriever, stub = make_retriever()
+    assert retriever.top_k("query", products, 2) == []
+    wait_for_background(retriever)
+    assert stub.calls == [[p["name"] for p in products]]
+
+    result = retriever.top_k("query", products, 2)
+    assert [p["sku"] for p in result] == ["RED", "BOOT"]
+
+
+def test_top_k_full_ordering_when_k_exceeds_products():
+    retriever, _ = make_retriever()
+    retriever.top_k("query", products, 10)
+    wait_for_background(retriever)
+
+    for k in (len(products), len(products) + 5):
+        result = retriever.top_k("query", products, k)
+        assert [p["sku"] for p in result] == ["RED", "BOOT", "BLUE", "MUG"]
+
+
+def test_top_k_memoizes_query_embedding():
+    retriever, stub = make_retriever()
+    retriever.top_k("query", products, 2)
+    wait_for_background(retriever)
+
+    retriever.top_k("query", products, 2)
+    retriever.top_k("query", products, 3)
+    assert stub.calls.count(["query"]) == 1
+
+
+def test_catalog_embedded_once_across_viewed_skus(monkeypatch):
+    monkeypatch.setattr(PromptFactory, "_prompt_cache", OrderedDict())
+    retriever, stub = make_retriever()
+    context = json.dumps([dict(p, price="1.00") for p in products])
+
+    def packed(sku):
+        factory = PromptFactory(sku=sku, context=context, num_recs=1, retriever=retriever)
+        return factory, [p["sku"] for p in json.loads(factory._compress_context())]
+
+    factory, _ = packed("RED")
+    assert factory._ranking == "tfidf"
+    wait_for_background(retriever)
+
+    # Different viewed SKUs share the one full catalog embedding
+    for sku in ("RED", "BOOT", "BLUE"):
+        factory, skus = packed(sku)
+        assert factory._ranking == "embedding"
+        assert sku not in skus
+    factory, skus = packed("BOOT")
+    assert skus == ["RED", "BLUE", "MUG"]
+
+    catalog_calls = [c for c in stub.calls if len(c) > 1]
+    assert catalog_calls == [[p["name"] for p in products]]
@@ -0,0 +1,253 @@
+import json
+import time
+import asyncio
+import httpx
+import pytest
+from types import SimpleNamespace
+from openai import RateLimitError
+import bitrecs.llms.chat_gpt as chat_gpt
+from bitrecs.llms.chat_gpt import ChatGPT
+
+
+def make_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class StubStream:
+    def __init__(self, chunks, delay=0.0):
+        self.chunks = chunks
+        self.delay = delay
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            if self.delay:
+                time.sleep(self.delay)
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+
+class StubCompletions:
+    def __init__(self, stream):
+        self.stream = stream
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.stream
+
+
+def make_gpt(stream) -> tuple[ChatGPT, StubCompletions]:
+    gpt = ChatGPT("test-key")
+    completions = StubCompletions(stream)
+    gpt.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    return gpt, completions
+
+
+prompt = "Recommend 3 products for SKU-001"
+
+
+def test_call_chat_gpt_stream_joined():
+    # Usage/keep-alive chunks arrive with choices == []
+    chunks = [SimpleNamespace(choices=[]), make_chunk('[{"sku": '), make_chunk(None),
+              make_chunk('"A1"}]'), SimpleNamespace(choices=[])]
+    gpt, completions = make_gpt(StubStream(chunks))
+    assert gpt.last_ttft is None
+
+    result = gpt.call_chat_gpt(prompt)
+    assert result == '[{"sku": "A1"}]'
+    assert gpt.last_ttft is not None and gpt.last_ttft >= 0
+    assert completions.calls[0]["stream"] is True
+    assert completions.calls[0]["messages"][-1]["content"] == prompt
+
+
+def test_call_chat_gpt_no_content_leaves_ttft_unset():
+    gpt, _ = make_gpt(StubStream([SimpleNamespace(choices=[]), make_chunk("")]))
+    assert gpt.call_chat_gpt(prompt) == ""
+    assert gpt.last_ttft is None
+
+
+def test_call_chat_gpt_total_deadline():
+    stream = StubStream([make_chunk("x")] * 10, delay=0.03)
+    gpt, _ = make_gpt(stream)
+    gpt.REQUEST_TIMEOUT = 0.05
+    with pytest.raises(TimeoutError):
+        gpt.call_chat_gpt(prompt)
+    assert stream.closed
+
+
+class AsyncStubStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        pass
+
+
+class AsyncStubCompletions:
+    def __init__(self, rate_limited=0):
+        self.rate_limited = rate_limited
+        self.calls = 0
+        self.in_flight = 0
+        self.peak = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.rate_limited:
+            self.rate_limited -= 1
+            response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+            raise RateLimitError("rate limited", response=response, body=None)
+        prompt = kwargs["messages"][-1]["content"]
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        # Later prompts finish first
+        await asyncio.sleep(0.02 - int(prompt[-2:]) * 0.0005)
+        self.in_flight -= 1
+        return AsyncStubStream([SimpleNamespace(choices=[]), make_chunk("echo "), make_chunk(prompt[-2:])])
+
+
+class AsyncStubClient:
+    def __init__(self, completions):
+        self.chat = SimpleNamespace(completions=completions)
+        self.opened = 0
+        self.closed = 0
+
+    async def __aenter__(self):
+        self.opened += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.closed += 1
+
+
+def make_async_gpt(monkeypatch, completions) -> ChatGPT:
+    client = AsyncStubClient(completions)
+    monkeypatch.setattr(chat_gpt, "new_async_openai_client", lambda key: client)
+    gpt = ChatGPT("test-key")
+    gpt.stub_client = client
+    gpt.RETRY_DELAY = 0.001
+    return gpt
+
+
+prompts = [f"Recommend products, prompt {i:02d}" for i in range(20)]
+
+
+def test_call_many_order_and_concurrency_cap(monkeypatch):
+    completions = AsyncStubCompletions()
+    gpt = make_async_gpt(monkeypatch, completions)
+
+    results = asyncio.run(gpt.call_many(prompts))
+    assert results == [f"echo {i:02d}" for i in range(20)]
+    assert completions.peak == ChatGPT.MAX_CONCURRENCY
+    # One client per call_many, closed before its event loop
+    assert gpt.stub_client.opened == gpt.stub_client.closed == 1
+
+    # Same instance on a new event loop, the semaphore must not be bound to the old one
+    results = asyncio.run(gpt.call_many(prompts))
+    assert results == [f"echo {i:02d}" for i in range(20)]
+    assert completions.peak == ChatGPT.MAX_CONCURRENCY
+
+
+def test_acall_chat_gpt_retries_rate_limit(monkeypatch):
+    completions = AsyncStubCompletions(rate_limited=2)
+    gpt = make_async_gpt(monkeypatch, completions)
+
+    assert asyncio.run(gpt.acall_chat_gpt(prompts[7])) == "echo 07"
+    assert completions.calls == 3
+    assert gpt.stub_client.opened == gpt.stub_client.closed == 1
+
+
+def test_acall_chat_gpt_raises_after_max_retries(monkeypatch):
+    completions = AsyncStubCompletions(rate_limited=ChatGPT.MAX_RETRIES + 1)
+    gpt = make_async_gpt(monkeypatch, completions)
+
+    with pytest.raises(RateLimitError):
+        asyncio.run(gpt.acall_chat_gpt(prompts[0]))
+    assert completions.calls == ChatGPT.MAX_RETRIES + 1
+
+
+class StubFiles:
+    def __init__(self, output=""):
+        self.output = output
+        self.uploads = []
+
+    def create(self, file, purpose):
+        name, data = file
+        self.uploads.append((name, data.read().decode("utf-8"), purpose))
+        return SimpleNamespace(id="file-in")
+
+    def content(self, file_id):
+        assert file_id == "file-out"
+        return SimpleNamespace(text=self.output)
+
+
+class StubBatches:
+    def __init__(self, statuses, total=0):
+        self.statuses = list(statuses)
+        self.total = total
+        self.created = []
+
+    def create(self, **kwargs):
+        self.created.append(kwargs)
+        return SimpleNamespace(id="batch-1")
+
+    def retrieve(self, batch_id):
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        done = status in ChatGPT.BATCH_TERMINAL_STATES
+        return SimpleNamespace(id=batch_id, status=status,
+                               output_file_id="file-out" if done else None,
+                               request_counts=SimpleNamespace(total=self.total))
+
+
+def make_batch_gpt(statuses, output="", total=0) -> tuple[ChatGPT, StubFiles, StubBatches]:
+    gpt = ChatGPT("test-key")
+    files, batches = StubFiles(output), StubBatches(statuses, total)
+    gpt.client = SimpleNamespace(files=files, batches=batches)
+    return gpt, files, batches
+
+
+def batch_line(idx, status_code, content=None):
+    body = {"choices": [{"message": {"content": content}}]} if status_code == 200 else {"error": {"message": "bad"}}
+    return json.dumps({"custom_id": str(idx), "response": {"status_code": status_code, "body": body}})
+
+
+def test_submit_batch_jsonl_shape():
+    gpt, files, batches = make_batch_gpt(["validating"])
+    assert gpt.submit_batch(prompts[:3]) == "batch-1"
+
+    name, payload, purpose = files.uploads[0]
+    assert purpose == "batch" and name.endswith(".jsonl")
+    lines = [json.loads(line) for line in payload.splitlines()]
+    assert [line["custom_id"] for line in lines] == ["0", "1", "2"]
+    for line, p in zip(lines, prompts):
+        assert line["method"] == "POST"
+        assert line["url"] == ChatGPT.BATCH_ENDPOINT
+        assert "stream" not in line["body"] and "timeout" not in line["body"]
+        assert line["body"]["messages"][-1]["content"] == p
+    assert batches.created[0]["input_file_id"] == "file-in"
+    assert batches.created[0]["endpoint"] == ChatGPT.BATCH_ENDPOINT
+
+    with pytest.raises(ValueError):
+        gpt.submit_batch([])
+
+
+def test_fetch_batch_pending_then_results():
+    # Output lines come back in any order, failed requests have a non-200 status
+    output = "\n".join([batch_line(2, 200, "third"), batch_line(0, 200, "first"), batch_line(1, 500), ""])
+    gpt, _, _ = make_batch_gpt(["in_progress", "finalizing", "completed"], output, total=3)
+
+    assert gpt.fetch_batch("batch-1") == ("in_progress", None)
+    status, results = gpt.fetch_batch("batch-1", wait=True, poll_interval=0)
+    assert status == "completed"
+    assert results == ["first", None, "third"]
+
+
+def test_fetch_batch_expired_keeps_partial_output():
+    gpt, _, _ = make_batch_gpt(["expired"], batch_line(1, 200, "second"), total=3)
+    assert gpt.fetch_batch("batch-1") == ("expired", [None, "second", None])
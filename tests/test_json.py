@@ -592,6 +592,40 @@ def test_model_name_re():
         assert claned == model, f"Model '{model}' did not match the regex correctly"
 
 
+def test_tryparse_llm_cached_copy():
+    llm_response = '```json\n[{"sku": "24-UG01", "name": "Quest Lumaflex&trade; Band", "price": "19", "reason": "Great choice"}]\n```'
+    first = PromptFactory.tryparse_llm(llm_response)
+    assert len(first) == 1
+    first[0]["sku"] = "changed"
+    first.append({"sku": "", "name": "", "price": "", "reason": ""})
+
+    second = PromptFactory.tryparse_llm(llm_response)
+    print(f"second: {second}")
+    assert len(second) == 1
+    assert second[0]["sku"] == "24-UG01"
+
+
+def test_tryparse_llm_repair():
+    truncated = '[{"sku": "24-UG01", "name": "Quest Lumaflex&trade; Band", "price": "19",}, {"sku": "24-UG02", "name": "Pursuit Lumaflex&trade; Tone Band"'
+    result = PromptFactory.tryparse_llm(truncated)
+    print(f"result: {result}")
+    assert [r["sku"] for r in result] == ["24-UG01", "24-UG02"]
+
+
+def test_tryparse_llm_nested_objects():
+    llm_response = 'Here you go: {"sku": "24-UG01", "name": "Band {large}", "meta": {"rank": 1}} and {"sku": "24-UG02", "name": "Tone Band"} done]['
+    result = PromptFactory.tryparse_llm(llm_response)
+    print(f"result: {result}")
+    assert [r["sku"] for r in result] == ["24-UG01", "24-UG02"]
+    assert result[0]["meta"]["rank"] == 1
+
+    # Unpaired quote in the prose before the first object
+    llm_response = 'Top picks for your 15" laptop: {"sku":"A1","name":"x"}, {"sku":"B2","name":"y"}'
+    result = PromptFactory.tryparse_llm(llm_response)
+    print(f"result: {result}")
+    assert [r["sku"] for r in result] == ["A1", "B2"]
+
+
 
 
 
@@ -0,0 +1,215 @@
+import json
+from collections import OrderedDict
+import bitrecs.llms.prompt_factory as prompt_factory
+from bitrecs.llms.prompt_factory import PromptFactory
+from bitrecs.utils.constants import MAX_RECS_PER_REQUEST
+
+
+def make_context(products: list) -> str:
+    return json.dumps([{"sku": sku, "name": name, "price": price} for sku, name, price in products])
+
+
+def packed_skus(factory: PromptFactory) -> list:
+    return [p["sku"] for p in json.loads(factory._compress_context())]
+
+
+shoe_catalog = [
+    ("SHOE-001", "Running Shoe Blue Mesh", "59.99"),
+    ("SOCK-002", "Cotton Ankle Socks 6 Pack", "9.99"),
+    ("SHOE-003", "Trail Running Shoe Waterproof", "89.99"),
+    ("MUG-004", "Ceramic Coffee Mug", "12.00"),
+    ("LACE-005", "Replacement Shoe Laces", "4.99"),
+]
+
+
+def test_compress_context_excludes_viewed_sku():
+    factory = PromptFactory(sku="SHOE-001", context=make_context(shoe_catalog), num_recs=3)
+    skus = packed_skus(factory)
+    print(f"packed: {skus}")
+    assert "SHOE-001" not in skus
+    assert len(skus) == len(shoe_catalog) - 1
+
+
+def test_compress_context_orders_by_relevance():
+    factory = PromptFactory(sku="SHOE-001", context=make_context(shoe_catalog), num_recs=3)
+    skus = packed_skus(factory)
+    print(f"packed: {skus}")
+    assert skus[0] == "SHOE-003"
+    assert skus.index("LACE-005") < skus.index("MUG-004")
+
+
+def test_compress_context_unknown_sku_keeps_catalog_order():
+    factory = PromptFactory(sku="NOT-THERE", context=make_context(shoe_catalog), num_recs=3)
+    assert packed_skus(factory) == [sku for sku, _, _ in shoe_catalog]
+
+
+def test_compress_context_budget_cutoff():
+    catalog = [(f"SKU-{i:04d}", f"Office Desk Organizer Tray Model {i} with Drawer", "19.99") for i in range(500)]
+    factory = PromptFactory(sku="SKU-0000", context=make_context(catalog), num_recs=1)
+    compressed = factory._compress_context()
+    skus = [p["sku"] for p in json.loads(compressed)]
+    print(f"packed {len(skus)} of {len(catalog)}")
+    assert 1 + PromptFactory.CONTEXT_EXTRA_PRODUCTS <= len(skus) < len(catalog) - 1
+    # Budget covers the entries, allow for the joining commas and brackets
+    assert PromptFactory._estimate_tokens(compressed) <= PromptFactory.CONTEXT_TOKEN_BUDGET + len(skus)
+
+
+def test_compress_context_packs_enough_for_num_recs():
+    catalog = [(f"SKU-{i:04d}", f"Extra Long Descriptive Product Name For Catalog Item Number {i} " * 3, "19.99") for i in range(100)]
+    num_recs = MAX_RECS_PER_REQUEST
+    factory = PromptFactory(sku="SKU-0000", context=make_context(catalog), num_recs=num_recs)
+    skus = packed_skus(factory)
+    print(f"packed {len(skus)} for num_recs={num_recs}")
+    assert len(skus) >= num_recs + PromptFactory.CONTEXT_EXTRA_PRODUCTS
+
+
+def test_compress_context_non_list_fallback():
+    context = "not a json catalog " * 100
+    factory = PromptFactory(sku="SHOE-001", context=context, num_recs=3)
+    compressed = factory._compress_context()
+    assert compressed == context[:600] + "..."
+
+    factory = PromptFactory(sku="SHOE-001", context="short context", num_recs=3)
+    assert factory._compress_context() == "short context"
+
+
+def test_response_cache_lru_eviction(monkeypatch):
+    monkeypatch.setattr(PromptFactory, "_response_cache", OrderedDict())
+    monkeypatch.setattr(PromptFactory, "CACHE_MAX_ENTRIES", 3)
+    context = make_context(shoe_catalog)
+    persona = PromptFactory.DEFAULT_PERSONA
+
+    for i in range(3):
+        PromptFactory.store_response_in_cache(f"SKU-{i}", context, 3, persona, [{"sku": f"REC-{i}"}])
+
+    # Hit moves SKU-0 to the end, so SKU-1 is now the oldest
+    assert PromptFactory.get_cached_response("SKU-0", context, 3, persona) == [{"sku": "REC-0"}]
+    assert next(reversed(PromptFactory._response_cache)).startswith("SKU-0_")
+
+    PromptFactory.store_response_in_cache("SKU-3", context, 3, persona, [{"sku": "REC-3"}])
+    assert len(PromptFactory._response_cache) == 3
+    assert PromptFactory.get_cached_response("SKU-1", context, 3, persona) is None
+    assert PromptFactory.get_cached_response("SKU-0", context, 3, persona) == [{"sku": "REC-0"}]
+    assert PromptFactory.get_cached_response("SKU-2", context, 3, persona) == [{"sku": "REC-2"}]
+    assert PromptFactory.get_cached_response("SKU-3", context, 3, persona) == [{"sku": "REC-3"}]
+
+
+def test_response_cache_ttl_uses_monotonic_clock(monkeypatch):
+    monkeypatch.setattr(PromptFactory, "_response_cache", OrderedDict())
+    now = [1000.0]
+    monkeypatch.setattr(prompt_factory.time, "monotonic", lambda: now[0])
+    context = make_context(shoe_catalog)
+    persona = PromptFactory.DEFAULT_PERSONA
+
+    PromptFactory.store_response_in_cache("SKU-0", context, 3, persona, [{"sku": "REC-0"}])
+    now[0] += PromptFactory.CACHE_TTL - 1
+    assert PromptFactory.get_cached_response("SKU-0", context, 3, persona) == [{"sku": "REC-0"}]
+    now[0] += 2
+    assert PromptFactory.get_cached_response("SKU-0", context, 3, persona) is None
+    assert len(PromptFactory._response_cache) == 0
+
+
+def test_prompt_cache_hit_miss_eviction(monkeypatch):
+    monkeypatch.setattr(PromptFactory, "_prompt_cache", OrderedDict())
+    monkeypatch.setattr(PromptFactory, "PROMPT_CACHE_SIZE", 2)
+    context = make_context(shoe_catalog)
+    compress_calls = []
+    original = PromptFactory._compress_context
+
+    def counting_compress(self):
+        compress_calls.append(self.sku)
+        return original(self)
+
+    monkeypatch.setattr(PromptFactory, "_compress_context", counting_compress)
+
+    first = PromptFactory(sku="SHOE-001", context=context, num_recs=3).generate_user_prompt()
+    assert PromptFactory(sku="SHOE-001", context=context, num_recs=3).generate_user_prompt() == first
+    assert compress_calls == ["SHOE-001"]
+
+    # Different num_recs is a miss
+    PromptFactory(sku="SHOE-001", context=context, num_recs=4).generate_user_prompt()
+    assert compress_calls == ["SHOE-001", "SHOE-001"]
+    assert len(PromptFactory._prompt_cache) == 2
+
+    # Third key evicts the oldest entry (SHOE-001, num_recs=3)
+    PromptFactory(sku="SHOE-003", context=context, num_recs=3).generate_user_prompt()
+    assert len(PromptFactory._prompt_cache) == 2
+    PromptFactory(sku="SHOE-001", context=context, num_recs=3).generate_user_prompt()
+    assert compress_calls == ["SHOE-001", "SHOE-001", "SHOE-003", "SHOE-001"]
+
+
+class StubRetriever:
+    def __init__(self, results):
+        self.results = results
+
+    def top_k(self, query, products, k):
+        if isinstance(self.results, Exception):
+            raise self.results
+        return self.results(products)
+
+
+def test_prompt_cache_skips_tfidf_fallback_with_retriever(monkeypatch):
+    monkeypatch.setattr(PromptFactory, "_prompt_cache", OrderedDict())
+    context = make_context(shoe_catalog)
+
+    # Retrieval failed, the TF-IDF prompt must not be reused once retrieval works
+    failing = StubRetriever(RuntimeError("timeout"))
+    factory = PromptFactory(sku="SHOE-001", context=context, num_recs=3, retriever=failing)
+    factory.generate_user_prompt()
+    assert factory._ranking == "tfidf"
+    assert len(PromptFactory._prompt_cache) == 0
+
+    # Catalog not embedded yet, same fallback
+    pending = StubRetriever(lambda products: [])
+    PromptFactory(sku="SHOE-001", context=context, num_recs=3, retriever=pending).generate_user_prompt()
+    assert len(PromptFactory._prompt_cache) == 0
+
+    reverse = StubRetriever(lambda products: list(reversed(products)))
+    factory = PromptFactory(sku="SHOE-001", context=context, num_recs=3, retriever=reverse)
+    prompt = factory.generate_user_prompt()
+    assert factory._ranking == "embedding"
+    assert len(PromptFactory._prompt_cache) == 1
+    assert prompt.index("LACE-005") < prompt.index("SHOE-003")
+
+
+def test_generate_prompt_is_system_plus_user(monkeypatch):
+    monkeypatch.setattr(PromptFactory, "_prompt_cache", OrderedDict())
+    factory = PromptFactory(sku="SHOE-001", context=make_context(shoe_catalog), num_recs=3)
+    system_prompt, user_prompt = factory.generate_prompt_parts()
+
+    assert system_prompt == factory.generate_system_prompt()
+    assert user_prompt == factory.generate_user_prompt()
+    assert factory.generate_prompt() == system_prompt + user_prompt
+
+    # Persona and rules live only in the system prompt
+    persona = PromptFactory.PERSONAS[factory.persona]
+    assert persona["description"] in system_prompt
+    for text in (persona["description"], "You are", "Values:", "MUST respond"):
+        assert text not in user_prompt
+    assert "SHOE-003" in user_prompt
+
+
+def test_catalog_index_shared_across_skus(monkeypatch):
+    monkeypatch.setattr(PromptFactory, "_catalog_cache", OrderedDict())
+    monkeypatch.setattr(PromptFactory, "CATALOG_CACHE_SIZE", 1)
+    parses = []
+    original = prompt_factory.ProductFactory.try_parse_context
+
+    def counting_parse(context):
+        parses.append(context)
+        return original(context)
+
+    monkeypatch.setattr(prompt_factory.ProductFactory, "try_parse_context", staticmethod(counting_parse))
+    context = make_context(shoe_catalog)
+
+    first = packed_skus(PromptFactory(sku="SHOE-001", context=context, num_recs=3))
+    second = packed_skus(PromptFactory(sku="SHOE-003", context=context, num_recs=3))
+    assert len(parses) == 1
+    assert "SHOE-001" not in first and first[0] == "SHOE-003"
+    assert "SHOE-003" not in second and second[0] == "SHOE-001"
+
+    # A different catalog evicts the only entry, so the first one is parsed again
+    other = make_context(shoe_catalog[:3])
+    packed_skus(PromptFactory(sku="SHOE-001", context=other, num_recs=3))
+    packed_skus(PromptFactory(sku="SHOE-003", context=context, num_recs=3))
+    assert len(parses) == 3
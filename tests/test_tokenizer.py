@@ -69,6 +69,14 @@ def test_get_token_count():
             case 3: assert tc == 59
 
 
+def test_get_token_counts_batch():
+    counts = PromptFactory.get_token_counts(copy_pastas)
+    print(counts)
+    assert counts == [PromptFactory.get_token_count(pasta) for pasta in copy_pastas]
+    assert counts == [71, 64, 29, 59]
+    assert PromptFactory.get_token_counts([]) == []
+
+
 def test_get_token_count_random1k_prompt():
     raw_products = product_1k()
     products = ProductFactory.dedupe(raw_products)